@@ -0,0 +1,955 @@
+import os
+import re
+import json
+import time
+import hashlib
+import fnmatch
+import tempfile
+import threading
+import requests
+from urllib.parse import urlparse, urlunparse
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import logging
+from typing import Dict, Tuple, Optional, List, Callable
+
+
+# 配置日志
+def setup_logger(log_file: str):
+    """
+    配置日志系统，将日志写入文件，并在控制台显示提示信息
+    :param log_file: 日志文件路径
+    """
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    # 文件日志处理器
+    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    file_handler.setLevel(logging.INFO)
+    file_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    file_handler.setFormatter(file_formatter)
+
+    # 控制台日志处理器
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_formatter = logging.Formatter("%(message)s")
+    console_handler.setFormatter(console_formatter)
+
+    # 添加处理器
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+
+    return logger
+
+
+# 初始化日志
+log_file = os.path.join(os.getcwd(), "markdown_image_downloader.log")
+logger = setup_logger(log_file)
+
+# 下载指标报告文件路径
+metrics_file = os.path.join(os.getcwd(), "markdown_image_downloader_metrics.json")
+
+# 图片内容索引文件名（保存在库根目录）
+INDEX_FILE_NAME = ".markdown_image_index.json"
+
+# URL 规范化规则：主机匹配模式 -> 需要去掉的查询参数（支持通配符，"*" 表示去掉全部查询参数）
+# 只用于生成缓存键，实际请求仍使用原始 URL
+CANONICAL_QUERY_RULES: Dict[str, List[str]] = {
+    "*": ["x-oss-process", "imageMogr2*", "imageView2*", "watermark*", "utm_*", "spm"],
+    "*.csdnimg.cn": ["*"],
+    "*.zhimg.com": ["*"],
+}
+
+# 是否去掉 URL 片段（例如 #pic_center）
+STRIP_URL_FRAGMENT = True
+
+# 各协议的默认端口
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# 重定向目标缓存：规范化 URL -> 重定向后的规范化 URL
+redirect_cache: Dict[str, str] = {}
+
+# 缓存已下载的图片（键为规范化 URL）
+image_cache: Dict[str, str] = {}
+
+
+def strip_query_params(host: str, query: str) -> str:
+    """
+    按主机规则去掉查询参数
+    :param host: 主机名（小写）
+    :param query: 原始查询字符串
+    :return: 去掉参数并排序后的查询字符串
+    """
+    strip_patterns = []
+    for host_pattern, params in CANONICAL_QUERY_RULES.items():
+        if fnmatch.fnmatch(host, host_pattern):
+            strip_patterns.extend(params)
+    if "*" in strip_patterns:
+        return ""
+
+    kept = []
+    for part in query.split("&"):
+        if not part:
+            continue
+        name = part.split("=", 1)[0]
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in strip_patterns):
+            kept.append(part)
+    return "&".join(sorted(kept))
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    规范化 URL，用作缓存键
+    协议和主机名转小写、去掉默认端口、按规则去掉查询参数和片段，并应用已记录的重定向目标
+    :param url: 原始 URL
+    :return: 规范化后的 URL
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    try:
+        port = parsed.port
+    except ValueError:  # 非法端口，保持原样
+        return url
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    if parsed.username:
+        netloc = f"{parsed.netloc.rsplit('@', 1)[0]}@{netloc}"
+    query = strip_query_params(host, parsed.query)
+    fragment = "" if STRIP_URL_FRAGMENT else parsed.fragment
+    canonical = urlunparse((scheme, netloc, parsed.path or "/", parsed.params, query, fragment))
+    return redirect_cache.get(canonical, canonical)
+
+
+def record_redirect(url: str, final_url: str):
+    """
+    记录重定向目标，后续相同的 URL 直接使用重定向后的缓存键
+    :param url: 原始 URL
+    :param final_url: 重定向后的 URL
+    """
+    if not final_url:
+        return
+    source = canonicalize_url(url)
+    target = canonicalize_url(final_url)
+    if source != target:
+        redirect_cache[source] = target
+
+
+class DownloadMetrics:
+    """
+    线程安全的下载指标统计
+    记录下载字节数、图片数、进行中的任务数和各主机的耗时分布，用于实时进度和最终的 JSON 报告
+    """
+
+    # 耗时分布的分桶上限（秒），超过最后一个分桶的计入 "+inf"
+    LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, total: int = 0):
+        """开始新一轮统计"""
+        with self.lock:
+            self.start_time = time.time()
+            self.total = total  # 待处理图片总数
+            self.done = 0  # 已完成图片数
+            self.success = 0  # 成功图片数
+            self.failed = 0  # 失败图片数
+            self.in_flight = 0  # 正在处理的图片数
+            self.cache_hits = 0  # 命中缓存的图片数
+            self.bytes = 0  # 已下载字节数
+            self.hosts: Dict[str, dict] = {}  # 主机 -> 请求统计
+
+    def task_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def task_finished(self, success: bool):
+        with self.lock:
+            self.in_flight -= 1
+            self.done += 1
+            if success:
+                self.success += 1
+            else:
+                self.failed += 1
+
+    def record_cache_hit(self):
+        with self.lock:
+            self.cache_hits += 1
+
+    def record_request(self, url: str, elapsed: float, size: int, ok: bool):
+        """
+        记录一次 HTTP 请求
+        :param url: 请求的 URL
+        :param elapsed: 耗时（秒）
+        :param size: 响应字节数
+        :param ok: 请求是否成功
+        """
+        host = urlparse(url).netloc
+        bucket = next((f"<={b}s" for b in self.LATENCY_BUCKETS if elapsed <= b), "+inf")
+        with self.lock:
+            stats = self.hosts.setdefault(host, {"requests": 0, "errors": 0, "bytes": 0, "total_seconds": 0.0,
+                                                 "latency_histogram": {}})
+            stats["requests"] += 1
+            stats["bytes"] += size
+            stats["total_seconds"] += elapsed
+            if not ok:
+                stats["errors"] += 1
+            stats["latency_histogram"][bucket] = stats["latency_histogram"].get(bucket, 0) + 1
+            self.bytes += size
+
+    def snapshot(self) -> dict:
+        """获取当前指标的快照"""
+        with self.lock:
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            images_per_sec = self.done / elapsed
+            remaining = self.total - self.done
+            hosts = {}
+            for host, stats in self.hosts.items():
+                hosts[host] = dict(stats, latency_histogram=dict(stats["latency_histogram"]),
+                                   avg_seconds=stats["total_seconds"] / stats["requests"])
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "total": self.total,
+                "done": self.done,
+                "success": self.success,
+                "failed": self.failed,
+                "in_flight": self.in_flight,
+                "cache_hits": self.cache_hits,
+                "bytes": self.bytes,
+                "bytes_per_sec": round(self.bytes / elapsed, 1),
+                "images_per_sec": round(images_per_sec, 3),
+                "eta_seconds": round(remaining / images_per_sec, 1) if images_per_sec > 0 else None,
+                "hosts": hosts,
+            }
+
+    @staticmethod
+    def format_progress(snapshot: dict) -> str:
+        """格式化为一行进度信息"""
+        eta = snapshot["eta_seconds"]
+        eta_text = f"{eta:.0f}s" if eta is not None else "--"
+        return (f"进度: {snapshot['done']}/{snapshot['total']}，进行中: {snapshot['in_flight']}，"
+                f"失败: {snapshot['failed']}，{snapshot['images_per_sec']:.1f} 张/秒，"
+                f"{snapshot['bytes_per_sec'] / 1024:.1f} KB/秒，预计剩余: {eta_text}")
+
+    def dump_json(self, path: str):
+        """将指标写入 JSON 文件"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+
+# 下载指标
+metrics = DownloadMetrics()
+
+
+def start_progress_reporter(interval: float = 2.0) -> threading.Event:
+    """
+    启动后台线程，定时在控制台输出下载进度
+    :param interval: 输出间隔（秒）
+    :return: 停止事件，set() 后线程退出
+    """
+    stop_event = threading.Event()
+
+    def report():
+        while not stop_event.wait(interval):
+            logger.info(DownloadMetrics.format_progress(metrics.snapshot()))
+
+    threading.Thread(target=report, daemon=True).start()
+    return stop_event
+
+# 正则表达式匹配多种图片引用格式
+IMAGE_PATTERNS = [
+    r"!\[(.*?)\]\((.*?)(?:\s+\"(.*?)\")?\)",  # Markdown 格式：![alt](url "title")
+    r"<img\s+[^>]*src=[\"'](.*?)[\"'][^>]*>",  # HTML 格式：<img src="url" alt="alt">
+    r"!\[(.*?)\]\[(.*?)\]",  # Markdown 引用链接格式：![alt][ref]
+    r"\[(.*?)\]:\s*(.*?)(?:\s+\"(.*?)\")?",  # Markdown 引用链接定义：[ref]: url "title"
+]
+
+
+def download_image(url: str, folder: str, proxies: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """
+    下载图片并保存到指定文件夹
+    :param url: 图片的 URL
+    :param folder: 图片保存文件夹
+    :param proxies: 代理配置，例如 {"http": "http://proxy-server:port", "https": "http://proxy-server:port"}
+    :return: 本地图片路径（如果下载成功），否则返回 None
+    """
+    cache_key = canonicalize_url(url)
+    if cache_key in image_cache:
+        metrics.record_cache_hit()
+        return image_cache[cache_key]
+
+    start = time.time()
+    response = None
+    try:
+        response = requests.get(url, timeout=10, allow_redirects=True, proxies=proxies)
+        metrics.record_request(url, time.time() - start, len(response.content), response.status_code < 400)
+        response.raise_for_status()  # 检查请求是否成功
+
+        # 记录重定向目标，重定向后的 URL 命中缓存时不再重复下载
+        final_url = response.url
+        if final_url and final_url != url:
+            record_redirect(url, final_url)
+            final_key = canonicalize_url(final_url)
+            if final_key in image_cache:
+                metrics.record_cache_hit()
+                image_cache[cache_key] = image_cache[final_key]
+                return image_cache[final_key]
+
+        # 提取文件名
+        parsed_url = urlparse(url)
+        filename = os.path.basename(parsed_url.path)
+        if not filename:  # 如果 URL 中没有文件名，生成一个唯一文件名
+            filename = f"image_{hash(url)}.png"
+        filepath = os.path.join(folder, filename)
+
+        # 保存图片
+        save_image_bytes(filepath, response.content)
+
+        image_cache[cache_key] = filepath
+        if final_url:
+            image_cache[canonicalize_url(final_url)] = filepath
+        return filepath
+    except Exception as e:
+        if response is None:  # 请求未完成（超时、连接失败等）
+            metrics.record_request(url, time.time() - start, 0, False)
+        logger.error(f"下载失败: {url}, 错误: {e}")
+    return None
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    计算文件内容的 SHA-256 哈希
+    :param path: 文件路径
+    :param chunk_size: 每次读取的字节数
+    :return: 十六进制哈希值
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 本次运行新建的图片文件（保存前不存在），"rewrite" 去重时只删除这些文件
+created_images = set()
+created_images_lock = threading.Lock()
+
+
+class ContentIndex:
+    """
+    图片内容索引：按内容哈希记录每份图片的规范路径，用于下载后去重
+    索引保存在库根目录的 .markdown_image_index.json 中，路径相对于库根目录
+    """
+
+    def __init__(self, root: str, mode: str = "hardlink"):
+        """
+        :param root: 库根目录
+        :param mode: 去重方式，"hardlink" 用硬链接替换重复文件，"rewrite" 删除重复文件并将链接指向规范路径
+        """
+        self.root = os.path.abspath(root)
+        self.mode = mode
+        self.index_file = os.path.join(self.root, INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        self.hashes: Dict[str, str] = {}  # 内容哈希 -> 规范路径（相对于库根目录）
+        self.verified = set()  # 本次运行已校验（或由本次运行登记）的内容哈希，规范文件不再重复读取
+        self.dedupe_count = 0  # 去重的图片数
+        self.saved_bytes = 0  # 节省的字节数
+        self.load()
+
+    def load(self):
+        """读取已有索引"""
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self.hashes = json.load(f).get("hashes", {})
+        except Exception as e:
+            logger.error(f"读取图片索引 {self.index_file} 失败: {e}")
+
+    def save(self):
+        """保存索引（临时文件 + 重命名）"""
+        tmp_path = self.index_file + ".tmp"
+        with self.lock:
+            data = {"version": 1, "hashes": dict(self.hashes)}
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.index_file)
+        except Exception as e:
+            logger.error(f"保存图片索引 {self.index_file} 失败: {e}")
+
+    def dedupe(self, path: str) -> str:
+        """
+        登记一张图片，与已有图片内容相同时去重
+        哈希计算和文件操作都在锁外进行，规范文件每次运行只校验一次，不会让其他线程等待磁盘读取
+        "rewrite" 模式只删除本次运行新建的文件，运行前已存在的文件可能被其他笔记引用，只改写链接
+        :param path: 图片路径
+        :return: 去重后应引用的图片路径
+        """
+        digest = hash_file(path)
+        while True:
+            with self.lock:
+                canonical_rel = self.hashes.get(digest)
+                verified = digest in self.verified
+            canonical = os.path.join(self.root, canonical_rel) if canonical_rel else None
+            valid = canonical is not None and os.path.exists(canonical) and (
+                verified or (os.path.getsize(canonical) == os.path.getsize(path) and hash_file(canonical) == digest))
+            with self.lock:
+                if self.hashes.get(digest) != canonical_rel:
+                    continue  # 其他线程同时登记了新的规范文件，重新检查
+                self.verified.add(digest)
+                # 规范文件不存在或内容已变化时，改由当前文件作为规范文件
+                if not valid:
+                    self.hashes[digest] = os.path.relpath(os.path.abspath(path), self.root)
+                    return path
+            break
+
+        if os.path.samefile(canonical, path):
+            return path
+
+        size = os.path.getsize(path)
+        if self.mode == "rewrite":
+            with created_images_lock:
+                created = os.path.abspath(path) in created_images
+            if created:
+                os.remove(path)
+            else:
+                size = 0
+            result = canonical
+        else:
+            tmp_path = path + ".link.tmp"
+            try:
+                os.link(canonical, tmp_path)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                # 跨设备或文件系统不支持硬链接时保留原文件
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                logger.warning(f"创建硬链接失败，保留原文件: {path}, 错误: {e}")
+                return path
+            result = path
+        with self.lock:
+            self.dedupe_count += 1
+            self.saved_bytes += size
+
+        logger.info(f"重复图片已去重: {path} -> {canonical}")
+        return result
+
+
+def save_image_bytes(filepath: str, data: bytes):
+    """
+    保存图片内容：先写临时文件再重命名
+    目标文件是硬链接时只替换目录项，不会改写共享同一份内容的其他文件
+    """
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    created = not os.path.exists(filepath)
+    os.replace(tmp_path, filepath)
+    if created:
+        with created_images_lock:
+            created_images.add(os.path.abspath(filepath))
+
+
+def copy_local_image(src_path: str, folder: str) -> Optional[str]:
+    """
+    复制本地图片到指定文件夹
+    :param src_path: 源图片路径
+    :param folder: 图片保存文件夹
+    :return: 复制后的图片路径（如果复制成功），否则返回 None
+    """
+    if not os.path.exists(src_path):
+        logger.error(f"图片不存在: {src_path}")
+        return None
+
+    filename = os.path.basename(src_path)
+    dest_path = os.path.join(folder, filename)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    with open(src_path, "rb") as src:
+        save_image_bytes(dest_path, src.read())
+    return dest_path
+
+
+def is_online_image(url: str) -> bool:
+    """判断是否为在线图片"""
+    return url.startswith(("http://", "https://"))
+
+
+def is_local_image(url: str) -> bool:
+    """判断是否为需要复制的本地图片（绝对路径或 ./、../ 开头的相对路径）"""
+    return os.path.isabs(url) or url.startswith(("./", "../"))
+
+
+def extract_ref_links(md_content: str) -> Dict[str, Tuple[str, str]]:
+    """
+    提取所有引用链接定义
+    :param md_content: Markdown 文件内容
+    :return: {引用标识: (url, title)}
+    """
+    ref_links = {}
+    for match in re.finditer(IMAGE_PATTERNS[3], md_content):
+        ref_key = match.group(1).strip().lower()
+        ref_url = match.group(2).strip()
+        ref_title = match.group(3) if match.group(3) else ""
+        ref_links[ref_key] = (ref_url, ref_title)
+    return ref_links
+
+
+def parse_image_match(match, pattern_index: int, ref_links: Dict[str, Tuple[str, str]]) -> Tuple[Optional[str], str, str]:
+    """
+    从正则匹配结果中解析图片信息
+    :param match: 正则匹配结果
+    :param pattern_index: 匹配使用的格式在 IMAGE_PATTERNS 中的下标
+    :param ref_links: 引用链接定义
+    :return: (url, alt, title)
+    """
+    url = None
+    alt = ""
+    title = ""
+
+    if pattern_index == 0:  # Markdown 格式：![alt](url "title")
+        alt = match.group(1)
+        url = match.group(2)
+        title = match.group(3) if match.group(3) else ""
+    elif pattern_index == 1:  # HTML 格式：<img src="url" alt="alt">
+        url = match.group(1)
+        # 从 HTML 标签中提取 alt 和 title
+        alt_match = re.search(r'alt=[\"\'](.*?)[\"\']', match.group(0))
+        title_match = re.search(r'title=[\"\'](.*?)[\"\']', match.group(0))
+        alt = alt_match.group(1) if alt_match else ""
+        title = title_match.group(1) if title_match else ""
+    elif pattern_index == 2:  # Markdown 引用链接格式：![alt][ref]
+        ref_key = match.group(2).strip().lower()
+        if ref_key in ref_links:
+            url, title = ref_links[ref_key]
+            alt = match.group(1)
+
+    return url, alt, title
+
+
+def render_image_link(match, pattern_index: int, url: str, alt: str, title: str, relative_path: str) -> str:
+    """
+    生成替换后的图片引用
+    :return: 指向本地图片的图片引用
+    """
+    if pattern_index == 0 or pattern_index == 2:  # Markdown 格式
+        return f'![{alt}]({relative_path} "{title}")' if title else f'![{alt}]({relative_path})'
+    else:  # HTML 格式
+        return match.group(0).replace(url, relative_path)
+
+
+class NoteJob:
+    """
+    单个 Markdown 文件的处理任务
+    记录该笔记还在等待的图片，最后一张图片处理完成时即可写回文件，不必等待其他笔记
+    """
+
+    def __init__(self, md_file: str, folder: str, content: str):
+        self.md_file = md_file
+        self.folder = folder
+        self.content = content
+        self.ref_links = extract_ref_links(content)
+        # 任务键 -> 该笔记中对应的图片链接（同一张图片可能以不同写法出现多次）
+        self.keys: Dict[object, List[str]] = {}
+        # 图片链接 -> 本地图片路径（处理失败为 None）
+        self.resolved: Dict[str, Optional[str]] = {}
+        self.committed = False
+        self.written: Optional[bool] = None  # 是否实际写回了文件（内容未变化时跳过）
+
+        for pattern_index, pattern in enumerate(IMAGE_PATTERNS[:3]):  # 引用链接定义不需要替换
+            for match in re.finditer(pattern, content):
+                url, _, _ = parse_image_match(match, pattern_index, self.ref_links)
+                if not url:
+                    continue
+                if is_online_image(url) or is_local_image(url):
+                    urls = self.keys.setdefault(self.task_key(url), [])
+                    if url not in urls:
+                        urls.append(url)
+                else:
+                    logger.warning(f"跳过非在线图片: {url}")
+
+        self.pending = len(self.keys)
+
+    def task_key(self, url: str):
+        """在线图片按规范化 URL 去重，本地图片按（源文件，目标文件夹）去重"""
+        if is_online_image(url):
+            return canonicalize_url(url)
+        return os.path.normpath(os.path.join(os.path.dirname(self.md_file), url)), self.folder
+
+    def resolve(self, key, local_path: Optional[str]) -> bool:
+        """
+        记录一张图片的处理结果
+        :return: 该笔记的所有图片是否都已处理完成
+        """
+        for url in self.keys.get(key, []):
+            if url not in self.resolved:
+                self.resolved[url] = local_path
+        self.pending -= 1
+        return self.pending == 0
+
+
+def fetch_image(url: str, job: NoteJob, proxies: Optional[Dict[str, str]] = None,
+                content_index: Optional[ContentIndex] = None) -> Optional[str]:
+    """
+    获取单张图片：在线图片下载，本地图片复制
+    :param content_index: 图片内容索引（可选），提供时对获取到的图片去重
+    :return: 本地图片路径（如果成功），否则返回 None
+    """
+    local_path = None
+    metrics.task_started()
+    try:
+        if is_online_image(url):
+            local_path = download_image(url, job.folder, proxies=proxies)
+            if local_path:
+                logger.info(f"下载成功: {url} -> {local_path}")
+        else:
+            src_path = os.path.join(os.path.dirname(job.md_file), url)
+            local_path = copy_local_image(src_path, job.folder)
+            if local_path:
+                logger.info(f"复制成功: {src_path} -> {local_path}")
+
+        if local_path and content_index is not None:
+            try:
+                local_path = content_index.dedupe(local_path)
+                if is_online_image(url):
+                    image_cache[canonicalize_url(url)] = local_path
+            except Exception as e:
+                logger.error(f"图片去重失败: {local_path}, 错误: {e}")
+        return local_path
+    finally:
+        metrics.task_finished(local_path is not None)
+
+
+def apply_resolved_links(job: NoteJob) -> Tuple[str, int, int]:
+    """
+    根据已处理的图片结果替换 Markdown 内容中的图片链接
+    :param job: 笔记处理任务
+    :return: (替换后的 Markdown 内容, 成功数量, 失败数量)
+    """
+    success_count = 0  # 成功处理的图片引用数
+    fail_count = 0  # 处理失败的图片引用数
+
+    new_content = job.content
+    for pattern_index, pattern in enumerate(IMAGE_PATTERNS[:3]):
+        def replace_match(match):
+            nonlocal success_count, fail_count
+            url, alt, title = parse_image_match(match, pattern_index, job.ref_links)
+            if not url or url not in job.resolved:
+                return match.group(0)  # 返回原始内容
+            local_path = job.resolved[url]
+            if not local_path:
+                fail_count += 1
+                return match.group(0)
+            # 替换为相对路径
+            relative_path = os.path.relpath(local_path, os.path.dirname(job.md_file))
+            success_count += 1
+            return render_image_link(match, pattern_index, url, alt, title, relative_path)
+
+        new_content = re.sub(pattern, replace_match, new_content)
+
+    return new_content, success_count, fail_count
+
+
+def write_markdown_atomic(md_file: str, content: str, original_content: Optional[str] = None) -> bool:
+    """
+    原子写入 Markdown 文件：先写入同目录下的临时文件并 fsync，再重命名覆盖原文件
+    中途中断时原文件保持不变，不会出现被截断的笔记
+    :param md_file: Markdown 文件路径
+    :param content: 新内容
+    :param original_content: 原内容，与新内容相同时跳过写入，避免改动文件修改时间
+    :return: 是否实际写入了文件
+    """
+    if original_content is not None and content == original_content:
+        return False
+
+    md_dir = os.path.dirname(md_file) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(md_file)}.", suffix=".tmp", dir=md_dir)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        # 保留原文件的权限
+        if os.path.exists(md_file):
+            os.chmod(tmp_path, os.stat(md_file).st_mode & 0o7777)
+        os.replace(tmp_path, md_file)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # 同步目录项，确保重命名本身落盘（Windows 不支持打开目录）
+    if os.name != "nt":
+        dir_fd = os.open(md_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return True
+
+
+def commit_note(job: NoteJob):
+    """
+    将笔记的处理结果写回 Markdown 文件
+    :param job: 笔记处理任务
+    """
+    new_content, success_count, fail_count = apply_resolved_links(job)
+    job.committed = True
+
+    try:
+        job.written = write_markdown_atomic(job.md_file, new_content, job.content)
+        if job.written:
+            logger.info(f"Markdown 文件已更新: {job.md_file}（成功: {success_count}，失败: {fail_count}，未完成: {job.pending}）")
+        else:
+            logger.info(f"Markdown 文件内容未变化，跳过写入: {job.md_file}")
+    except Exception as e:
+        logger.error(f"保存文件 {job.md_file} 失败: {e}")
+
+
+def run_note_jobs(jobs: List[NoteJob], proxies: Optional[Dict[str, str]] = None, max_workers: int = 5,
+                  on_complete: Callable[[NoteJob], None] = commit_note,
+                  index_root: Optional[str] = None, dedupe_mode: Optional[str] = None):
+    """
+    统一调度所有笔记的图片任务
+    所有笔记的图片共用一个线程池，某个笔记的最后一张图片完成时立即写回该笔记，
+    最后再对未完成的笔记（中断或异常）做一次收尾写回
+    :param jobs: 笔记处理任务列表
+    :param proxies: 代理配置
+    :param max_workers: 下载线程数
+    :param on_complete: 笔记完成时的回调，默认写回 Markdown 文件
+    :param index_root: 图片内容索引所在的库根目录
+    :param dedupe_mode: 去重方式（"hardlink" 或 "rewrite"），为 None 时不去重
+    """
+    content_index = ContentIndex(index_root, dedupe_mode) if dedupe_mode and index_root else None
+
+    waiting: Dict[object, List[NoteJob]] = {}  # 任务键 -> 等待该图片的笔记
+    tasks: Dict[object, Tuple[str, NoteJob]] = {}  # 任务键 -> (图片链接, 负责下载的笔记)
+    for job in jobs:
+        if job.pending == 0:
+            on_complete(job)
+            continue
+        for key, urls in job.keys.items():
+            waiting.setdefault(key, []).append(job)
+            tasks.setdefault(key, (urls[0], job))
+
+    logger.info(f"共 {len(tasks)} 张待处理图片")
+    metrics.reset(total=len(tasks))
+    stop_reporter = start_progress_reporter()
+    futures: Dict[Future, object] = {}  # 图片任务 -> 任务键
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(fetch_image, url, job, proxies, content_index): key
+                for key, (url, job) in tasks.items()
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    local_path = future.result()
+                except Exception as e:
+                    logger.error(f"处理图片失败: {tasks[key][0]}, 错误: {e}")
+                    local_path = None
+                for job in waiting.pop(key, []):
+                    if job.resolve(key, local_path):
+                        on_complete(job)
+    finally:
+        # 中断时线程池退出前仍会等待已提交的图片完成，先收集这些结果，避免图片已保存而笔记中的链接没有替换
+        for future, key in futures.items():
+            if key not in waiting or not future.done() or future.cancelled():
+                continue
+            try:
+                local_path = future.result()
+            except Exception as e:
+                logger.error(f"处理图片失败: {tasks[key][0]}, 错误: {e}")
+                local_path = None
+            for job in waiting.pop(key, []):
+                job.resolve(key, local_path)
+
+        # 收尾：写回尚未完成的笔记，已完成的图片照常替换
+        stragglers = [job for job in jobs if not job.committed]
+        if stragglers:
+            logger.warning(f"有 {len(stragglers)} 个 Markdown 文件未全部完成，写回已完成的图片")
+        for job in stragglers:
+            on_complete(job)
+
+        # 打印写回统计信息
+        written_count = sum(1 for job in jobs if job.written)
+        skipped_count = sum(1 for job in jobs if job.written is False)
+        logger.info(f"写回 Markdown 文件: {written_count}，内容未变化跳过: {skipped_count}")
+
+        # 保存图片内容索引
+        if content_index is not None:
+            content_index.save()
+            logger.info(f"重复图片去重: {content_index.dedupe_count}，节省空间: {content_index.saved_bytes / 1024:.1f} KB")
+
+        # 输出最终指标并写入 JSON 报告
+        stop_reporter.set()
+        logger.info(DownloadMetrics.format_progress(metrics.snapshot()))
+        try:
+            metrics.dump_json(metrics_file)
+            logger.info(f"下载指标已保存到: {metrics_file}")
+        except Exception as e:
+            logger.error(f"保存下载指标失败: {e}")
+
+
+def replace_image_links(md_content: str, folder: str, md_file: str, proxies: Optional[Dict[str, str]] = None) -> str:
+    """
+    替换 Markdown 内容中的在线图片链接为本地路径
+    :param md_content: Markdown 文件内容
+    :param folder: 图片保存文件夹
+    :param md_file: Markdown 文件路径
+    :param proxies: 代理配置
+    :return: 替换后的 Markdown 内容
+    """
+    job = NoteJob(md_file, folder, md_content)
+    results = []
+
+    def collect(finished_job: NoteJob):
+        finished_job.committed = True
+        results.append(apply_resolved_links(finished_job))
+
+    run_note_jobs([job], proxies=proxies, on_complete=collect)
+    new_content, success_count, fail_count = results[0]
+
+    # 打印统计信息
+    logger.info("图片处理完成！")
+    logger.info(f"成功下载: {success_count}")
+    logger.info(f"下载失败: {fail_count}")
+
+    return new_content
+
+
+def prepare_note_job(md_file: str, image_folder: Optional[str] = None) -> Optional[NoteJob]:
+    """
+    读取 Markdown 文件并创建处理任务
+    :param md_file: Markdown 文件路径
+    :param image_folder: 图片保存文件夹（可选，默认为 ./image/markdown文件名）
+    :return: 笔记处理任务，读取失败返回 None
+    """
+    # 获取 Markdown 文件名（不含扩展名）
+    md_filename = os.path.splitext(os.path.basename(md_file))[0]
+
+    # 如果未提供 image_folder，则设置为默认路径
+    if image_folder is None:
+        image_folder = os.path.join(os.path.dirname(md_file), "image", md_filename)
+    else:
+        # 将 image_folder 转换为相对于当前 Markdown 文件的绝对路径，并拼接 Markdown 文件名
+        image_folder = os.path.join(os.path.dirname(md_file), image_folder, md_filename)
+
+    # 创建图片保存文件夹
+    os.makedirs(image_folder, exist_ok=True)
+
+    # 读取 Markdown 文件
+    try:
+        with open(md_file, "r", encoding="utf-8") as f:
+            content = f.read()
+    except Exception as e:
+        logger.error(f"读取文件 {md_file} 失败: {e}")
+        return None
+
+    return NoteJob(md_file, image_folder, content)
+
+
+def process_markdown_file(md_file: str, image_folder: Optional[str] = None, proxies: Optional[Dict[str, str]] = None,
+                          dedupe_mode: Optional[str] = None):
+    """
+    处理单个 Markdown 文件，下载在线图片并替换链接
+    :param md_file: Markdown 文件路径
+    :param image_folder: 图片保存文件夹（可选，默认为 ./image/markdown文件名）
+    :param proxies: 代理配置
+    :param dedupe_mode: 去重方式（"hardlink" 或 "rewrite"），为 None 时不去重
+    """
+    job = prepare_note_job(md_file, image_folder)
+    if job is None:
+        return
+
+    run_note_jobs([job], proxies=proxies, index_root=os.path.dirname(os.path.abspath(md_file)), dedupe_mode=dedupe_mode)
+
+    # 在每个文件处理完成后打印空行
+    logger.info("")
+
+
+def find_markdown_files(folder: str) -> list:
+    """
+    递归查找指定文件夹下的所有 Markdown 文件
+    :param folder: 目标文件夹
+    :return: 所有 Markdown 文件的路径列表
+    """
+    md_files = []
+    for root, _, files in os.walk(folder):
+        for file in files:
+            if file.endswith(".md"):
+                md_files.append(os.path.join(root, file))
+    return md_files
+
+
+def process_markdown_folder(folder: str, image_folder: Optional[str] = None, proxies: Optional[Dict[str, str]] = None,
+                            dedupe_mode: Optional[str] = None):
+    """
+    处理指定文件夹及其子文件夹下的所有 Markdown 文件
+    所有笔记的图片统一调度，每个笔记完成后立即写回
+    :param folder: Markdown 文件所在文件夹
+    :param image_folder: 图片保存文件夹（可选，默认为 ./image/markdown文件名）
+    :param proxies: 代理配置
+    :param dedupe_mode: 去重方式（"hardlink" 或 "rewrite"），为 None 时不去重
+    """
+    # 递归查找所有 Markdown 文件
+    md_files = find_markdown_files(folder)
+    logger.info(f"找到 {len(md_files)} 个 Markdown 文件")
+
+    # 读取所有 Markdown 文件并创建任务
+    jobs = []
+    for md_file in md_files:
+        job = prepare_note_job(md_file, image_folder)
+        if job is not None:
+            jobs.append(job)
+
+    run_note_jobs(jobs, proxies=proxies, index_root=folder, dedupe_mode=dedupe_mode)
+
+
+def main(input_path: str, image_folder: Optional[str] = None, proxies: Optional[Dict[str, str]] = None,
+         dedupe_mode: Optional[str] = None):
+    """
+    主函数，根据输入路径是文件还是文件夹进行处理
+    :param input_path: 输入的 Markdown 文件或文件夹路径
+    :param image_folder: 图片保存文件夹（可选，默认为 ./image/markdown文件名）
+    :param proxies: 代理配置
+    :param dedupe_mode: 去重方式（"hardlink" 或 "rewrite"），为 None 时不去重
+    """
+    if os.path.isfile(input_path) and input_path.endswith(".md"):
+        # 如果是单个 Markdown 文件
+        logger.info(f"=== 处理文件: {input_path} ===")
+        process_markdown_file(input_path, image_folder, proxies=proxies, dedupe_mode=dedupe_mode)
+    elif os.path.isdir(input_path):
+        # 如果是文件夹
+        process_markdown_folder(input_path, image_folder, proxies=proxies, dedupe_mode=dedupe_mode)
+    else:
+        logger.error(f"输入路径无效: {input_path}")
+
+
+"""
+URL 规范化：
+CDN 链接经常只差缩放、水印或跟踪参数（?x-oss-process=...、?imageMogr2、#pic_center），以前会被当作不同图片重复下载。
+新增 canonicalize_url，缓存查找和任务去重前统一规范化 URL：
+协议和主机名转小写、去掉默认端口、去掉片段，按 CANONICAL_QUERY_RULES 按主机去掉查询参数。
+记录下载时的重定向目标，之后相同的 URL 直接使用重定向后的缓存键。
+规范化只用于缓存键，实际请求仍使用原始 URL。
+"""
+if __name__ == "__main__":
+    # 设置输入路径（可以是单个 Markdown 文件或文件夹）
+    input_path = "C:\\Users\\codeh\\Desktop\\SoftwareTesting.md"  # 替换为你的 Markdown 文件或文件夹路径
+
+    # 设置图片保存路径（可选，默认为 ./image/markdown文件名）
+    image_folder = "./image"  # 替换为你的自定义相对路径，或设置为 None 使用默认路径
+
+    # 设置代理（可选），如果不需要代理，可以将 proxies 设置为 None
+    proxies = {
+        "http": "http://127.0.0.1:7890",  # 替换为你的 HTTP 代理地址
+        "https": "https://127.0.0.1:7890",  # 替换为你的 HTTPS 代理地址
+    }
+
+    # 设置去重方式（可选）："hardlink" 使用硬链接，"rewrite" 改写链接到同一路径，None 不去重（默认，不写入索引文件）
+    dedupe_mode = None
+
+    # 处理输入路径
+    main(input_path, image_folder, proxies=proxies, dedupe_mode=dedupe_mode)
@@ -0,0 +1,1515 @@
+import io
+import os
+import queue
+import atexit
+import re
+import gzip
+import json
+import hashlib
+import tarfile
+import tempfile
+import urllib.parse
+from tqdm import tqdm  # 导入 tqdm 库
+import time
+import shutil
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+try:
+    import zstandard  # 可选依赖，用于 zstd 压缩备份归档
+except ImportError:
+    zstandard = None
+
+try:
+    import xxhash  # 可选依赖，用于更快地查找重复图片
+except ImportError:
+    xxhash = None
+
+try:
+    import numpy as np  # 可选依赖，用于查找相似图片
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+# 创建日志处理器，指定文件编码为 utf-8
+handler = RotatingFileHandler(
+    'clean_unused_images.log',
+    encoding='utf-8',  # 指定文件编码
+    maxBytes=5*1024*1024,  # 日志文件最大 5MB
+    backupCount=3  # 保留 3 个备份文件
+)
+
+handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+# 热点日志采样：同一调用位置的 INFO 及以下级别日志，前 LOG_SAMPLE_FIRST 条全部输出，之后每 LOG_SAMPLE_EVERY 条输出 1 条
+LOG_SAMPLE_FIRST = 20
+LOG_SAMPLE_EVERY = 500
+
+class HotPathSampler(logging.Filter):
+    """
+    按调用位置（文件和行号）对 INFO 及以下级别的日志采样，WARNING 及以上级别全部保留
+    被省略的日志只计数，结束时按调用位置输出汇总；带 extra={"sample": False} 的日志不参与采样
+    删除、备份、恢复和更新链接等逐个文件的操作日志都带 extra={"sample": False}，日志中始终保留完整的操作记录
+    """
+
+    def __init__(self, first=LOG_SAMPLE_FIRST, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.first = first
+        self.every = every
+        self.lock = threading.Lock()
+        self.counts = {}  # (文件, 行号) -> [总条数, 省略条数, 函数名]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, "sample", True):
+            return True
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            counter = self.counts.get(key)
+            if counter is None:
+                counter = self.counts[key] = [0, 0, record.funcName]
+            counter[0] += 1
+            if counter[0] <= self.first or (counter[0] - self.first) % self.every == 0:
+                return True
+            counter[1] += 1
+        return False
+
+    def summary(self):
+        """返回被省略过日志的调用位置汇总（按省略条数从多到少）"""
+        with self.lock:
+            items = [(suppressed, total, func, lineno)
+                     for (_, lineno), (total, suppressed, func) in self.counts.items() if suppressed]
+        return sorted(items, reverse=True)
+
+# 配置日志：工作线程只把日志放入队列，由后台线程写入文件，避免多个线程在文件处理器的锁上排队
+log_queue = queue.Queue(-1)
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+log_sampler = HotPathSampler()
+queue_handler.addFilter(log_sampler)
+logging.basicConfig(
+    level=logging.INFO,
+    handlers=[queue_handler]  # 使用队列处理器
+)
+log_listener = QueueListener(log_queue, handler, respect_handler_level=True)
+log_listener.start()
+
+def stop_logging():
+    """输出采样汇总，等待队列中的日志全部写入文件后停止后台线程"""
+    for suppressed, total, func, lineno in log_sampler.summary():
+        logging.warning(f"日志采样: {func}（第 {lineno} 行）共 {total} 条，省略 {suppressed} 条")
+    log_listener.stop()
+
+atexit.register(stop_logging)
+
+# 定义图标
+ICON_INFO = "ℹ️"  # 提示信息
+ICON_WARNING = "⚠️"  # 警告信息
+ICON_ERROR = "❌"  # 错误信息
+ICON_SUCCESS = "✅"  # 成功信息
+ICON_FILE = "📄"  # 文件信息
+ICON_FOLDER = "📁"  # 文件夹信息
+ICON_IMAGE = "🖼️"  # 图片信息
+
+# 每个文件系统（设备）上同时执行删除/移动的线程数
+DEVICE_WORKERS = 4
+
+# 每个批次包含的文件数
+REMOVAL_BATCH_SIZE = 256
+
+# 计算图片哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 路径规范化缓存的最大条目数
+PATH_CACHE_SIZE = 65536
+
+# 合法的 URL 编码
+URL_ENCODING_PATTERN = re.compile(r"%[0-9A-Fa-f]{2}")
+
+# 图片文件扩展名（查找重复图片时使用）
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".svg", ".tif", ".tiff", ".ico")
+
+# 查找重复图片时，先比较文件开头和结尾各这么多字节的哈希
+PARTIAL_HASH_SIZE = 64 * 1024
+
+# 查找重复图片时计算哈希的线程数
+HASH_WORKERS = 8
+
+# 感知哈希的边长（8 表示 64 位哈希）
+PERCEPTUAL_HASH_SIZE = 8
+
+# 计算 pHash 时缩放到的边长
+PHASH_IMAGE_SIZE = 32
+
+# 汉明距离不超过该值的两张图片视为相似图片（64 位哈希）
+NEAR_DUPLICATE_THRESHOLD = 6
+
+# 计算汉明距离时每个分块的哈希数量（分块大小的平方决定单次比较的内存占用）
+HAMMING_BLOCK_SIZE = 1024
+
+# 不能用 Pillow 读取的图片格式
+NON_RASTER_EXTENSIONS = (".svg",)
+
+# 归档中每个文件的 tar 格式（PAX 支持中文等非 ASCII 文件名）
+ARCHIVE_TAR_FORMAT = tarfile.PAX_FORMAT
+
+# 图片文件记录：路径、大小（字节）、修改时间、inode、设备号（inode 只在同一设备内唯一）
+ImageRecord = namedtuple("ImageRecord", ["path", "size", "mtime", "inode", "dev"])
+
+class ImageInventory:
+    """
+    基于 os.scandir 的图片文件清单
+    复用 DirEntry 自带的类型和 stat 信息，每个目录只列出一次并缓存，可在清理、检查等步骤之间共享
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirs = {}  # 目录 -> (文件记录列表, 子目录列表, 规范化大小写后的路径集合)
+
+    def list_dir(self, directory):
+        """列出单个目录（不递归），返回 (文件记录列表, 子目录列表)"""
+        directory = os.path.normpath(os.path.abspath(directory))
+        with self.lock:
+            if directory in self.dirs:
+                files, subdirs, _ = self.dirs[directory]
+                return files, subdirs
+
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files.append(ImageRecord(entry.path, stat.st_size, stat.st_mtime, stat.st_ino, stat.st_dev))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        except OSError as e:
+            logging.error(f"读取目录失败: {directory}, 错误: {e}")
+
+        names = {os.path.normcase(path) for path in subdirs}
+        names.update(os.path.normcase(record.path) for record in files)
+        with self.lock:
+            self.dirs[directory] = (files, subdirs, names)
+        return files, subdirs
+
+    def scan(self, folder):
+        """递归扫描文件夹，返回所有文件记录"""
+        records = []
+        stack = [folder]
+        while stack:
+            files, subdirs = self.list_dir(stack.pop())
+            records.extend(files)
+            stack.extend(subdirs)
+        return records
+
+    def devices(self):
+        """返回已扫描文件的路径到设备号（st_dev）的映射"""
+        with self.lock:
+            return {record.path: record.dev for files, _, _ in self.dirs.values() for record in files}
+
+    def exists(self, path):
+        """通过已缓存的目录清单判断文件或目录是否存在"""
+        path = os.path.normpath(os.path.abspath(path))
+        self.list_dir(os.path.dirname(path))
+        with self.lock:
+            return os.path.normcase(path) in self.dirs[os.path.dirname(path)][2]
+
+def benchmark_logging(messages=100000, threads=8, log_file="logging_benchmark.log"):
+    """
+    比较多线程热点循环中三种日志方式的耗时：同步写文件、队列、队列 + 采样
+    工作线程耗时为所有线程写完日志的时间，总耗时包括等待队列中的日志全部写入文件，返回 {方式: (工作线程耗时, 总耗时)}
+    """
+    def run(name, handlers, sampler=None):
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        file_handler = RotatingFileHandler(log_file, encoding='utf-8', maxBytes=512*1024*1024, backupCount=1)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger = logging.getLogger(f"benchmark.{name}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        listener = None
+        if handlers == "queue":
+            bench_queue = queue.Queue(-1)
+            bench_handler = QueueHandler(bench_queue)
+            bench_handler.setFormatter(logging.Formatter('%(message)s'))
+            if sampler is not None:
+                bench_handler.addFilter(sampler)
+            listener = QueueListener(bench_queue, file_handler)
+            listener.start()
+            logger.addHandler(bench_handler)
+        else:
+            logger.addHandler(file_handler)
+
+        def work(worker):
+            for i in range(messages // threads):
+                logger.info(f"提取的图片路径 (Markdown): image/{worker}/{i}.png -> /vault/image/{worker}/{i}.png")
+
+        start_time = time.perf_counter()
+        workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        work_time = time.perf_counter() - start_time
+        if listener is not None:
+            listener.stop()
+        total_time = time.perf_counter() - start_time
+        for bench_handler in list(logger.handlers):
+            logger.removeHandler(bench_handler)
+        file_handler.close()
+        return work_time, total_time
+
+    results = {
+        "同步": run("sync", "sync"),
+        "队列": run("queue", "queue"),
+        "队列+采样": run("sampled", "queue", HotPathSampler()),
+    }
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    for name, (work_time, total_time) in results.items():
+        logging.info(f"日志基准测试 [{name}]: {messages} 条，{threads} 个线程，工作线程耗时 {work_time:.2f} 秒，"
+                     f"总耗时 {total_time:.2f} 秒")
+    return results
+
+def contains_url_encoding(path):
+    """检查路径中是否包含合法的 URL 编码"""
+    return URL_ENCODING_PATTERN.search(path) is not None
+
+def decode_path_if_encoded(path):
+    """如果路径包含合法的 URL 编码，则进行解码，否则返回原始路径"""
+    if contains_url_encoding(path):
+        try:
+            return urllib.parse.unquote(path)
+        except Exception as e:
+            logging.error(f"解码路径失败: {path}, 错误: {e}")
+            return path
+    return path
+
+class PathNormalizer:
+    """
+    带缓存的路径规范化：把笔记中的链接解析为规范化的绝对路径
+    以 (笔记所在目录, 原始链接) 为键缓存结果（有界 LRU），笔记库中反复出现的相同链接只解码和规范化一次
+    decode 为解码函数（例如 URL 解码），为 None 时不解码
+    """
+
+    def __init__(self, decode=None, max_entries=PATH_CACHE_SIZE):
+        self.decode = decode
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, path, base_dir):
+        key = (base_dir, path)
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+
+        decoded_path = self.decode(path) if self.decode is not None else path
+        result = os.path.normpath(os.path.abspath(os.path.join(base_dir, decoded_path)))
+        with self.lock:
+            self.cache[key] = result
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return result
+
+    def stats(self):
+        """返回缓存统计：条目数、命中数、未命中数、命中率"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"路径规范化缓存: {stats['entries']} 条，命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+                     f"命中率 {stats['hit_rate']:.1%}")
+
+path_normalizer = PathNormalizer(decode=decode_path_if_encoded)
+
+def normalize_path(path, md_file):
+    """统一路径格式（解码 URL 编码、转换为绝对路径并统一路径分隔符，结果带缓存）"""
+    return path_normalizer.normalize(path, os.path.dirname(md_file))
+
+def extract_used_images(md_content, md_file):
+    """从 Markdown 内容中提取所有使用的图片路径"""
+    used_images = set()
+
+    # 正则表达式匹配 Markdown 图片链接
+    md_pattern = r"!\[.*?\]\((.*?)(?:\s+\".*?\")?\)"  # 支持带标题的图片
+    for match in re.findall(md_pattern, md_content):
+        if not match.startswith(("http://", "https://", "data:image")):
+            # 对路径进行解码和规范化
+            abs_path = normalize_path(match, md_file)
+            logging.info(f"提取的图片路径 (Markdown): {match} -> {abs_path}")
+            used_images.add(abs_path)
+
+    # 正则表达式匹配 HTML <img> 标签中的图片链接
+    html_pattern = r"<img.*?src=[\"'](.*?)[\"'].*?>"  # 支持带属性和样式的图片
+    for match in re.findall(html_pattern, md_content):
+        if not match.startswith(("http://", "https://", "data:image")):
+            # 对路径进行解码和规范化
+            abs_path = normalize_path(match, md_file)
+            logging.info(f"提取的图片路径 (HTML): {match} -> {abs_path}")
+            used_images.add(abs_path)
+
+    # 正则表达式匹配 Markdown 引用格式的图片链接
+    ref_pattern = r"\[.*?\]\[(.*?)\]"  # 匹配引用标识
+    ref_link_pattern = r"\[(.*?)\]:\s*(.*?)(?:\s+\".*?\")?\s*$"  # 匹配引用定义
+    ref_links = dict(re.findall(ref_link_pattern, md_content, re.MULTILINE))
+    for match in re.findall(ref_pattern, md_content):
+        if match in ref_links and not ref_links[match].startswith(("http://", "https://", "data:image")):
+            # 对路径进行解码和规范化
+            abs_path = normalize_path(ref_links[match], md_file)
+            logging.info(f"提取的图片路径 (引用): {ref_links[match]} -> {abs_path}")
+            used_images.add(abs_path)
+
+    return used_images
+
+def read_used_images(md_file):
+    """读取单个 Markdown 文件并提取其中使用的图片路径"""
+    with open(md_file, "r", encoding="utf-8") as f:
+        content = f.read()
+    return extract_used_images(content, md_file)
+
+def build_used_image_set(md_files):
+    """
+    第一遍：并行解析所有 Markdown 文件，构建整个笔记库的已使用图片集合
+    返回 (已使用图片集合, 读取失败的 Markdown 文件集合)
+    """
+    used_images = set()
+    failed_files = set()
+
+    with ThreadPoolExecutor() as executor:
+        futures = {executor.submit(read_used_images, md_file): md_file for md_file in md_files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="解析 Markdown 文件", unit="文件"):
+            md_file = futures[future]
+            try:
+                used_images |= future.result()
+            except Exception as e:
+                logging.error(f"读取文件 {md_file} 失败: {e}")
+                failed_files.add(md_file)
+
+    logging.info(f"笔记库中已使用的本地图片数量: {len(used_images)}")
+    return used_images, failed_files
+
+def delete_unused_images(md_files, image_folder="image", backup_folder="backup", enable_backup=True, reference_files=None,
+                         backup_mode="store", archive_compression="zstd"):
+    """
+    删除未使用的图片
+    reference_files 为用于构建已使用图片集合的 Markdown 文件（默认与 md_files 相同），
+    只清理 md_files 对应的图片文件夹，但图片只要被 reference_files 中任意一个文件引用就会保留
+    backup_mode 为备份方式："store" 内容寻址仓库，"archive" 写入压缩归档（archive_compression 为 "zstd" 或 "gzip"），
+    "move" 按原目录结构移动到备份文件夹
+    """
+    # 第一遍：构建整个笔记库的已使用图片集合
+    if reference_files is None:
+        reference_files = md_files
+    else:
+        # 要清理的笔记总是参与构建已使用图片集合
+        known_files = set(reference_files)
+        reference_files = list(reference_files) + [md_file for md_file in md_files if md_file not in known_files]
+    used_images, failed_files = build_used_image_set(reference_files)
+    if failed_files:
+        # 已使用图片集合不完整：读取失败的笔记引用的图片可能在任何文件夹中，不清理任何图片文件夹
+        logging.warning(f"有 {len(failed_files)} 个 Markdown 文件读取失败，不清理任何图片文件夹")
+        md_files = []
+
+    # 如果启用备份功能，创建备份文件夹（未启用备份时不生成操作清单）
+    if enable_backup and not os.path.exists(backup_folder):
+        os.makedirs(backup_folder)
+        logging.info(f"创建备份文件夹: {backup_folder}")
+
+    # 第二遍：使用多线程逐个比对图片文件夹，只收集未使用的图片，不做删除
+    inventory = ImageInventory()
+    unused_images = set()
+    with ThreadPoolExecutor() as executor:
+        futures = []
+        for md_file in md_files:
+            futures.append(executor.submit(process_markdown_file, md_file, image_folder, used_images, inventory))
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="处理图片文件夹", unit="文件夹"):
+            unused_images.update(future.result())
+
+    # 删除阶段：统一按设备分批删除或备份
+    remove_images(unused_images, backup_folder, enable_backup, backup_mode=backup_mode, archive_compression=archive_compression,
+                  devices=inventory.devices())
+
+    logging.info(f"所有文件处理完成！")
+    logging.info(f"总未使用的图片数量: {len(unused_images)}")
+    path_normalizer.log_stats()
+
+def archive_member_name(path):
+    """将绝对路径转换为归档中的成员名（去掉盘符和开头的分隔符，统一使用 /）"""
+    drive, rest = os.path.splitdrive(os.path.abspath(path))
+    name = rest.replace("\\", "/").lstrip("/")
+    return f"{drive.rstrip(':')}/{name}" if drive else name
+
+class ArchiveBackup:
+    """
+    流式压缩备份归档：把所有被清理的图片写入同一个 tar 文件，而不是逐个移动到备份文件夹
+    每个文件单独压缩为一个 gzip 成员 / zstd 帧后顺序追加，整个文件仍是合法的 .tar.gz / .tar.zst，
+    同时在索引文件中记录每个文件的偏移和长度，恢复单个文件时只需解压对应的一段
+    """
+
+    def __init__(self, backup_folder, compression="zstd", run_id=None):
+        if compression == "zstd" and zstandard is None:
+            logging.warning("未安装 zstandard，备份归档改用 gzip 压缩")
+            compression = "gzip"
+        self.compression = compression
+        run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        extension = "zst" if compression == "zstd" else "gz"
+        # 同一秒内的多次运行不能覆盖彼此的归档：文件已存在时加序号
+        name = run_id
+        suffix = 1
+        while True:
+            self.archive_path = os.path.join(backup_folder, f"backup-{name}.tar.{extension}")
+            try:
+                self.file = open(self.archive_path, "xb")
+                break
+            except FileExistsError:
+                suffix += 1
+                name = f"{run_id}-{suffix}"
+        self.index_path = self.archive_path + ".index.json"
+        self.lock = threading.Lock()
+        self.entries = []
+
+    def compress(self, data):
+        """压缩为一个独立的 gzip 成员 / zstd 帧"""
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def add(self, path):
+        """读取并压缩一个文件后追加到归档（读取和压缩可在多个线程中并行，写入时加锁）"""
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        info = tarfile.TarInfo(archive_member_name(path))
+        info.size = len(data)
+        info.mtime = stat.st_mtime
+        info.mode = stat.st_mode & 0o7777
+        block = info.tobuf(format=ARCHIVE_TAR_FORMAT, encoding="utf-8")
+        block += data + b"\0" * (-len(data) % tarfile.BLOCKSIZE)
+        frame = self.compress(block)
+
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(frame)
+            self.entries.append({
+                "path": os.path.abspath(path),
+                "member": info.name,
+                "offset": offset,
+                "length": len(frame),
+                "size": len(data),
+                "mtime": stat.st_mtime,
+            })
+
+    def close(self):
+        """写入 tar 结束标记并落盘，然后保存索引"""
+        with self.lock:
+            self.file.write(self.compress(b"\0" * tarfile.BLOCKSIZE * 2))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            index = {
+                "archive": os.path.basename(self.archive_path),
+                "compression": self.compression,
+                "entries": self.entries,
+            }
+        # 索引先写入临时文件并落盘，再重命名，中途中断时不会留下不完整的索引
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.index_path)
+        logging.info(f"备份归档已保存: {self.archive_path}（{len(self.entries)} 个文件）")
+
+def hash_file(path):
+    """计算文件的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def new_fast_hash():
+    """重复图片检测使用的快速哈希（优先 xxh3，未安装 xxhash 时使用 blake2b）"""
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+def fast_hash_file(path, size, partial=False):
+    """
+    计算文件的快速哈希
+    partial 为 True 时只读取开头和结尾各 PARTIAL_HASH_SIZE 字节（小文件即为完整哈希）
+    """
+    digest = new_fast_hash()
+    with open(path, "rb") as f:
+        if partial and size > PARTIAL_HASH_SIZE * 2:
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+            f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+        else:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def bucket_by_hash(records, partial, workers):
+    """并行计算一组文件的哈希，返回 {(大小, 哈希): 文件记录列表}，读取失败的文件被忽略"""
+    buckets = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fast_hash_file, record.path, record.size, partial): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                buckets.setdefault((record.size, future.result()), []).append(record)
+            except OSError as e:
+                logging.error(f"读取图片失败: {record.path}, 错误: {e}")
+    return buckets
+
+def find_duplicate_images(records, workers=HASH_WORKERS):
+    """
+    查找内容完全相同的图片：先按大小分组，只对大小相同的文件计算开头和结尾的部分哈希，
+    部分哈希也相同的大文件再计算完整哈希，返回重复图片组（每组为按路径排序的文件记录列表）
+    """
+    by_size = {}
+    for record in records:
+        if record.size > 0:
+            by_size.setdefault(record.size, []).append(record)
+
+    candidates = []
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        # 硬链接指向同一份数据，删除其中一个不会节省空间
+        seen_inodes = set()
+        for record in group:
+            if record.inode and (record.dev, record.inode) in seen_inodes:
+                continue
+            seen_inodes.add((record.dev, record.inode))
+            candidates.append(record)
+
+    duplicates = []
+    full_hash_candidates = []
+    for (size, _), group in bucket_by_hash(candidates, True, workers).items():
+        if len(group) < 2:
+            continue
+        if size > PARTIAL_HASH_SIZE * 2:
+            full_hash_candidates.extend(group)
+        else:
+            duplicates.append(group)
+
+    for group in bucket_by_hash(full_hash_candidates, False, workers).values():
+        if len(group) > 1:
+            duplicates.append(group)
+
+    return [sorted(group, key=lambda record: record.path) for group in duplicates]
+
+def list_vault_images(vault_root, inventory=None, exclude_folders=()):
+    """列出笔记库中的所有图片文件（按扩展名判断），exclude_folders 中的文件夹（如备份文件夹）会被跳过"""
+    if inventory is None:
+        inventory = ImageInventory()
+    excluded = [os.path.normcase(os.path.abspath(folder)) + os.sep for folder in exclude_folders]
+    images = []
+    for record in inventory.scan(vault_root):
+        if not record.path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        if any(os.path.normcase(record.path).startswith(folder) for folder in excluded):
+            continue
+        images.append(record)
+    return images
+
+def report_duplicate_images(vault_root, report_file, exclude_folders=()):
+    """生成重复图片报告（JSON），按可回收空间从大到小列出每组重复图片，返回重复图片组"""
+    start_time = time.time()
+    images = list_vault_images(vault_root, exclude_folders=exclude_folders)
+    groups = find_duplicate_images(images)
+    groups.sort(key=lambda group: group[0].size * (len(group) - 1), reverse=True)
+
+    reclaimable = sum(group[0].size * (len(group) - 1) for group in groups)
+    report = {
+        "vault_root": os.path.abspath(vault_root),
+        "image_count": len(images),
+        "group_count": len(groups),
+        "duplicate_count": sum(len(group) - 1 for group in groups),
+        "reclaimable_bytes": reclaimable,
+        "groups": [
+            {
+                "size": group[0].size,
+                "count": len(group),
+                "reclaimable_bytes": group[0].size * (len(group) - 1),
+                "paths": [record.path for record in group],
+            }
+            for group in groups
+        ],
+    }
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    elapsed = time.time() - start_time
+    logging.info(f"扫描 {len(images)} 个图片，找到 {len(groups)} 组重复图片（{report['duplicate_count']} 个多余的副本），"
+                 f"可回收 {reclaimable / 1024 / 1024:.2f} MB，耗时 {elapsed:.2f} 秒")
+    logging.info(f"重复图片报告已保存: {report_file}")
+    return groups
+
+def dct_matrix(size):
+    """一维 DCT-II 变换矩阵（正交归一化），用于计算 pHash"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+def pack_hash(bits):
+    """将布尔矩阵打包为 64 位无符号整数"""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def compute_perceptual_hashes(path):
+    """
+    计算图片的 aHash、dHash 和 pHash（在子进程中运行）
+    返回 (路径, {方法: 64 位哈希})，读取失败时返回 (路径, 错误信息)
+    """
+    size = PERCEPTUAL_HASH_SIZE
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (PHASH_IMAGE_SIZE * 4, PHASH_IMAGE_SIZE * 4))  # JPEG 解码时直接缩小，减少计算量
+            gray = img.convert("L")
+    except Exception as e:
+        return path, str(e)
+
+    pixels = np.asarray(gray.resize((size, size), Image.BILINEAR), dtype=np.float32)
+    ahash = pack_hash(pixels > pixels.mean())
+
+    pixels = np.asarray(gray.resize((size + 1, size), Image.BILINEAR), dtype=np.float32)
+    dhash = pack_hash(pixels[:, 1:] > pixels[:, :-1])
+
+    pixels = np.asarray(gray.resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.BILINEAR), dtype=np.float64)
+    dct = dct_matrix(PHASH_IMAGE_SIZE)
+    coefficients = (dct @ pixels @ dct.T)[:size, :size]
+    phash = pack_hash(coefficients > np.median(coefficients.ravel()[1:]))
+
+    return path, {"ahash": ahash, "dhash": dhash, "phash": phash}
+
+def hash_images_in_processes(paths, workers=None):
+    """使用进程池计算所有图片的感知哈希，返回 {路径: {方法: 哈希}}"""
+    hashes = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(compute_perceptual_hashes, paths, chunksize=64)
+        for path, result in tqdm(results, total=len(paths), desc="计算感知哈希", unit="张"):
+            if isinstance(result, str):
+                logging.error(f"读取图片失败: {path}, 错误: {result}")
+            else:
+                hashes[path] = result
+    return hashes
+
+def popcount64(values):
+    """统计 uint64 数组中每个元素的 1 的个数"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+def find_similar_pairs(hashes, threshold=NEAR_DUPLICATE_THRESHOLD, block_size=HAMMING_BLOCK_SIZE):
+    """
+    在 uint64 哈希数组中查找汉明距离不超过 threshold 的所有图片对 (i, j, 距离)，i < j
+    按分块计算异或和 popcount，只比较上三角的分块，内存占用为 block_size 的平方
+    """
+    pairs = []
+    count = len(hashes)
+    for i in range(0, count, block_size):
+        rows = hashes[i:i + block_size]
+        for j in range(i, count, block_size):
+            columns = hashes[j:j + block_size]
+            distances = popcount64(rows[:, None] ^ columns[None, :])
+            row_index, column_index = np.nonzero(distances <= threshold)
+            row_index += i
+            column_index += j
+            keep = row_index < column_index
+            for a, b, d in zip(row_index[keep], column_index[keep],
+                               distances[row_index[keep] - i, column_index[keep] - j]):
+                pairs.append((int(a), int(b), int(d)))
+    return pairs
+
+def cluster_pairs(count, pairs):
+    """使用并查集把相似图片对合并为相似图片组，返回索引列表的列表（只包含两张及以上的组）"""
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b, _ in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    clusters = {}
+    for i in range(count):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+def report_near_duplicate_images(vault_root, report_file, exclude_folders=(), method="dhash",
+                                 threshold=NEAR_DUPLICATE_THRESHOLD, workers=None):
+    """
+    生成相似图片报告（JSON）：使用感知哈希（ahash / dhash / phash）查找重新截图、裁剪或压缩后的相似图片
+    需要安装 numpy 和 Pillow，返回相似图片组（每组为路径列表）
+    """
+    if np is None or Image is None:
+        logging.error("查找相似图片需要安装 numpy 和 Pillow")
+        return []
+
+    start_time = time.time()
+    images = [record for record in list_vault_images(vault_root, exclude_folders=exclude_folders)
+              if not record.path.lower().endswith(NON_RASTER_EXTENSIONS)]
+    sizes = {record.path: record.size for record in images}
+    image_hashes = hash_images_in_processes([record.path for record in images], workers)
+
+    paths = sorted(image_hashes)
+    hashes = np.array([image_hashes[path][method] for path in paths], dtype=np.uint64)
+    pairs = find_similar_pairs(hashes, threshold)
+    distances = {}
+    for a, b, d in pairs:
+        distances[a] = max(distances.get(a, 0), d)
+        distances[b] = max(distances.get(b, 0), d)
+    clusters = sorted(cluster_pairs(len(paths), pairs), key=len, reverse=True)
+
+    report = {
+        "vault_root": os.path.abspath(vault_root),
+        "method": method,
+        "threshold": threshold,
+        "image_count": len(paths),
+        "cluster_count": len(clusters),
+        "clusters": [
+            {
+                "count": len(members),
+                "total_bytes": sum(sizes[paths[i]] for i in members),
+                "max_distance": max(distances[i] for i in members),
+                "paths": [paths[i] for i in sorted(members)],
+            }
+            for members in clusters
+        ],
+    }
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    elapsed = time.time() - start_time
+    logging.info(f"使用 {method} 比较 {len(paths)} 个图片，找到 {len(clusters)} 组相似图片，耗时 {elapsed:.2f} 秒")
+    logging.info(f"相似图片报告已保存: {report_file}")
+    return [[paths[i] for i in sorted(members)] for members in clusters]
+
+def choose_canonical(group, reference_counts):
+    """从一组重复图片中选出保留的副本：被引用最多的优先，其次是修改时间最早、路径最短的"""
+    return min(group, key=lambda record: (-reference_counts.get(record.path, 0), record.mtime, len(record.path),
+                                          record.path))
+
+def relative_link(target, md_file, encoded=False):
+    """生成从 Markdown 文件指向 target 的相对链接（使用 /），encoded 为 True 时进行 URL 编码"""
+    try:
+        link = os.path.relpath(target, os.path.dirname(os.path.abspath(md_file)))
+    except ValueError:
+        # Windows 下位于不同盘符时无法生成相对路径
+        link = target
+    link = link.replace("\\", "/")
+    return urllib.parse.quote(link) if encoded else link
+
+def rewrite_image_links(md_content, md_file, replacements):
+    """
+    把 Markdown 内容中指向重复图片的链接（Markdown、HTML 和引用定义）改为指向保留的副本
+    replacements 为 {重复图片绝对路径: 保留的副本绝对路径}，返回 (新内容, 替换的链接数量)
+    """
+    replaced = 0
+
+    def replace(match):
+        nonlocal replaced
+        prefix, link, suffix = match.groups()
+        if link.startswith(("http://", "https://", "data:image")):
+            return match.group(0)
+        target = replacements.get(normalize_path(link, md_file))
+        if target is None:
+            return match.group(0)
+        replaced += 1
+        return prefix + relative_link(target, md_file, contains_url_encoding(link)) + suffix
+
+    md_content = re.sub(r"(!\[.*?\]\()(.*?)((?:\s+\".*?\")?\))", replace, md_content)
+    md_content = re.sub(r"(<img.*?src=[\"'])(.*?)([\"'].*?>)", replace, md_content)
+    md_content = re.sub(r"^(\[.*?\]:\s*)(.*?)((?:\s+\".*?\")?\s*)$", replace, md_content, flags=re.MULTILINE)
+    return md_content, replaced
+
+def write_markdown_atomic(md_file, content):
+    """原子写入 Markdown 文件：先写入同目录下的临时文件并 fsync，再重命名覆盖原文件"""
+    md_dir = os.path.dirname(md_file) or "."
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(md_file)}.", suffix=".tmp", dir=md_dir)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, os.stat(md_file).st_mode & 0o7777)
+        os.replace(temp_path, md_file)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def rewrite_note(md_file, replacements):
+    """读取一个 Markdown 文件，替换其中指向重复图片的链接并原子写回，返回替换的链接数量"""
+    with open(md_file, "r", encoding="utf-8") as f:
+        content = f.read()
+    new_content, replaced = rewrite_image_links(content, md_file, replacements)
+    if replaced:
+        write_markdown_atomic(md_file, new_content)
+        logging.info(f"更新链接: {md_file}（{replaced} 个）", extra={"sample": False})
+    return replaced
+
+def hardlink_image(path, target):
+    """用指向 target 的硬链接替换 path（先创建临时链接再重命名，中途失败时原文件保持不变）"""
+    temp_path = f"{path}.{threading.get_ident()}.link.tmp"
+    os.link(target, temp_path)
+    try:
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+def collapse_duplicate_images(reference_files, vault_root, backup_folder="backup", enable_backup=True,
+                              collapse_mode="hardlink", backup_mode="store", archive_compression="zstd"):
+    """
+    合并内容完全相同的图片：每组选出一个保留的副本，把整个笔记库中指向其他副本的链接改为指向它，
+    然后删除（collapse_mode = "remove"，按 backup_mode 备份并记录到操作清单，可撤销）
+    或硬链接（collapse_mode = "hardlink"，默认，遗漏的链接也不会失效）多余的副本
+    删除模式下，删除前重新读取所有 reference_files，仍被引用的副本保留
+    只处理字节完全相同的图片，相似图片不会被合并
+    """
+    start_time = time.time()
+    groups = find_duplicate_images(list_vault_images(vault_root, exclude_folders=[backup_folder]))
+    if not groups:
+        logging.info("没有重复图片")
+        return 0
+
+    # 统计每个图片被多少个笔记引用，同时记录每个笔记引用的图片
+    note_images = {}
+    reference_counts = {}
+    with ThreadPoolExecutor() as executor:
+        futures = {executor.submit(read_used_images, md_file): md_file for md_file in reference_files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="解析 Markdown 文件", unit="文件"):
+            md_file = futures[future]
+            try:
+                note_images[md_file] = future.result()
+            except Exception as e:
+                logging.error(f"读取文件 {md_file} 失败: {e}")
+                note_images[md_file] = None
+                continue
+            for image in note_images[md_file]:
+                reference_counts[image] = reference_counts.get(image, 0) + 1
+
+    replacements = {}
+    for group in groups:
+        canonical = choose_canonical(group, reference_counts)
+        for record in group:
+            if record.path != canonical.path:
+                replacements[os.path.normpath(record.path)] = canonical.path
+
+    # 每个笔记只读写一次，只处理引用了重复图片的笔记
+    affected = [md_file for md_file, images in note_images.items()
+                if images is not None and not images.isdisjoint(replacements)]
+    rewritten_links = 0
+    with ThreadPoolExecutor() as executor:
+        futures = {executor.submit(rewrite_note, md_file, replacements): md_file for md_file in affected}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="更新图片链接", unit="文件"):
+            md_file = futures[future]
+            try:
+                rewritten_links += future.result()
+            except Exception as e:
+                logging.error(f"更新文件 {md_file} 失败: {e}")
+
+    # 删除前重新构建整个笔记库的已使用图片集合：未改写的链接（读取或更新失败的笔记、其他写法）仍引用的副本保留
+    redundant = set(replacements)
+    if collapse_mode == "remove" and redundant:
+        used_images, failed_files = build_used_image_set(reference_files)
+        if failed_files:
+            logging.warning(f"有 {len(failed_files)} 个引用文件读取失败，不删除任何重复图片")
+            redundant = set()
+        else:
+            redundant -= used_images
+
+    if collapse_mode == "hardlink":
+        collapsed = 0
+        for path in tqdm(sorted(redundant), desc="硬链接重复图片", unit="张"):
+            try:
+                hardlink_image(path, replacements[path])
+                collapsed += 1
+            except OSError as e:
+                logging.error(f"硬链接失败: {path}, 错误: {e}")
+    else:
+        devices = {os.path.normpath(record.path): record.dev for group in groups for record in group}
+        collapsed = remove_images(redundant, backup_folder, enable_backup, backup_mode=backup_mode,
+                                  archive_compression=archive_compression, devices=devices)
+
+    reclaimed = sum(group[0].size * sum(1 for record in group if os.path.normpath(record.path) in redundant)
+                    for group in groups)
+    elapsed = time.time() - start_time
+    logging.info(f"合并 {len(groups)} 组重复图片：更新 {len(affected)} 个笔记中的 {rewritten_links} 个链接，"
+                 f"处理 {collapsed}/{len(redundant)} 个多余的副本，约回收 {reclaimed / 1024 / 1024:.2f} MB，"
+                 f"耗时 {elapsed:.2f} 秒")
+    path_normalizer.log_stats()
+    return collapsed
+
+class BackupStore:
+    """
+    内容寻址的备份仓库：图片按 sha256 保存为 objects/<前两位>/<哈希><扩展名>，
+    原路径记录在 manifest.jsonl 中，不同目录下的同名图片不会互相覆盖，内容相同的图片只保存一份
+    """
+
+    def __init__(self, backup_folder, run_id=None):
+        self.root = os.path.join(os.path.abspath(backup_folder), "store")
+        self.objects = os.path.join(self.root, "objects")
+        self.manifest_path = os.path.join(self.root, "manifest.jsonl")
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        os.makedirs(self.objects, exist_ok=True)
+        self.lock = threading.Lock()
+        self.manifest = open(self.manifest_path, "a", encoding="utf-8")
+        self.stored_count = 0
+        self.dedupe_count = 0
+        self.saved_bytes = 0
+
+    def blob_path(self, digest, ext):
+        return os.path.join(self.objects, digest[:2], digest + ext.lower())
+
+    def prepare_batch(self, paths):
+        """
+        为一批图片计算哈希并写入 manifest.jsonl，落盘（每批一次 fsync）后才移动原图片，中途崩溃时不会丢失原路径
+        返回 {原路径: 仓库中的文件路径}，读取失败的图片不在其中
+        """
+        prepared = {}
+        lines = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                digest = hash_file(path)
+            except OSError as e:
+                logging.error(f"操作失败: {path}, 错误: {e}")
+                continue
+            blob = self.blob_path(digest, os.path.splitext(path)[1])
+            prepared[path] = blob
+            entry = {
+                "run": self.run_id,
+                "path": os.path.abspath(path),
+                "blob": os.path.relpath(blob, self.root).replace("\\", "/"),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+            lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        with self.lock:
+            self.manifest.write("".join(lines))
+            self.manifest.flush()
+            os.fsync(self.manifest.fileno())
+        return prepared
+
+    def put(self, path, blob):
+        """
+        把图片移入仓库（同一设备上为重命名），仓库中已有相同内容时直接删除原图片，返回仓库中的文件路径
+        blob 为 prepare_batch 返回的仓库文件路径（记录已落盘）
+        """
+        size = os.path.getsize(path)
+        if os.path.exists(blob):
+            os.remove(path)
+            deduped = True
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.rename(path, blob)
+            except OSError:
+                # 跨设备时先复制为临时文件再重命名，保证仓库中不会出现写了一半的文件
+                temp_path = f"{blob}.{threading.get_ident()}.tmp"
+                shutil.copy2(path, temp_path)
+                os.replace(temp_path, blob)
+                os.remove(path)
+            deduped = False
+
+        with self.lock:
+            self.stored_count += 1
+            if deduped:
+                self.dedupe_count += 1
+                self.saved_bytes += size
+        logging.info(f"备份成功: {path} -> {blob}", extra={"sample": False})
+        return blob
+
+    def close(self):
+        with self.lock:
+            self.manifest.flush()
+            os.fsync(self.manifest.fileno())
+            self.manifest.close()
+        logging.info(f"备份仓库: 本次保存 {self.stored_count} 个文件，其中 {self.dedupe_count} 个内容重复，"
+                     f"节省 {self.saved_bytes / 1024 / 1024:.2f} MB")
+
+def restore_from_store(backup_folder, run_id=None, paths=None):
+    """
+    根据 manifest.jsonl 从备份仓库恢复图片到原路径（复制，仓库中的文件保留）
+    run_id 为只恢复某次运行的备份，paths 为需要恢复的原始路径集合，为 None 时不限制
+    """
+    root = os.path.join(backup_folder, "store")
+    restored = 0
+    with open(os.path.join(root, "manifest.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if run_id is not None and entry["run"] != run_id:
+                continue
+            if paths is not None and entry["path"] not in paths:
+                continue
+            blob = os.path.join(root, entry["blob"])
+            if not os.path.exists(blob):
+                # 已被撤销操作移回原路径，或记录已落盘但运行在移动图片前中断
+                logging.warning(f"仓库中的文件不存在: {blob}，跳过恢复: {entry['path']}")
+                continue
+            os.makedirs(os.path.dirname(entry["path"]), exist_ok=True)
+            shutil.copy2(blob, entry["path"])
+            os.utime(entry["path"], (entry["mtime"], entry["mtime"]))
+            restored += 1
+            logging.info(f"恢复成功: {entry['path']}", extra={"sample": False})
+    return restored
+
+def restore_from_archive(index_path, paths=None):
+    """
+    根据索引从备份归档中恢复图片到原路径，只解压需要恢复的文件
+    paths 为需要恢复的原始路径集合，为 None 时恢复全部
+    """
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    archive_path = os.path.join(os.path.dirname(index_path), index["archive"])
+    if index["compression"] == "zstd":
+        if zstandard is None:
+            raise RuntimeError("恢复 zstd 归档需要安装 zstandard")
+        decompress = zstandard.ZstdDecompressor().decompress
+    else:
+        decompress = gzip.decompress
+
+    restored = 0
+    with open(archive_path, "rb") as archive:
+        for entry in index["entries"]:
+            if paths is not None and entry["path"] not in paths:
+                continue
+            archive.seek(entry["offset"])
+            block = decompress(archive.read(entry["length"]))
+            with tarfile.open(fileobj=io.BytesIO(block), mode="r:") as tar:
+                member = tar.next()
+                data = tar.extractfile(member).read()
+            os.makedirs(os.path.dirname(entry["path"]), exist_ok=True)
+            with open(entry["path"], "wb") as out:
+                out.write(data)
+            os.utime(entry["path"], (entry["mtime"], entry["mtime"]))
+            restored += 1
+            logging.info(f"恢复成功: {entry['path']}", extra={"sample": False})
+    return restored
+
+class RunManifest:
+    """
+    单次清理运行的操作清单：backup/runs/<运行编号>.jsonl，每行记录一个被移动、备份或删除的图片，
+    用于 undo_run 撤销整次运行
+    """
+
+    def __init__(self, backup_folder):
+        self.folder = os.path.join(backup_folder, "runs")
+        os.makedirs(self.folder, exist_ok=True)
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while os.path.exists(os.path.join(self.folder, f"{self.run_id}.jsonl")):
+            suffix += 1
+            self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        self.path = os.path.join(self.folder, f"{self.run_id}.jsonl")
+        self.lock = threading.Lock()
+        self.file = open(self.path, "w", encoding="utf-8")
+
+    def record(self, action, path, target=None, size=None, mtime=None):
+        """记录一次操作，action 为 "move"、"store"、"archive" 或 "delete"，target 为备份位置（保存为绝对路径）"""
+        if target is not None:
+            target = os.path.abspath(target)
+        entry = {"action": action, "path": os.path.abspath(path), "target": target, "size": size, "mtime": mtime}
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def sync(self):
+        """把已记录的操作落盘（每批调用一次），运行中途崩溃时已完成的操作仍可撤销"""
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        logging.info(f"本次运行编号: {self.run_id}，操作清单: {self.path}")
+
+def load_run_manifest(backup_folder, run_id):
+    """读取某次运行的操作清单，返回 {原路径: 记录}"""
+    entries = {}
+    with open(os.path.join(backup_folder, "runs", f"{run_id}.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            entries[entry["path"]] = entry
+    return entries
+
+def count_store_references(backup_folder):
+    """统计备份仓库中每个文件被多少条记录引用（内容相同的图片共用一个文件）"""
+    manifest_path = os.path.join(backup_folder, "store", "manifest.jsonl")
+    counts = {}
+    if not os.path.exists(manifest_path):
+        return counts
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            blob = os.path.normpath(os.path.join(os.path.abspath(backup_folder), "store", json.loads(line)["blob"]))
+            counts[blob] = counts.get(blob, 0) + 1
+    return counts
+
+def undo_batch(batch, entries, store_references):
+    """撤销一批图片的操作，返回成功恢复的数量（同一设备上为重命名，只有仓库中被多条记录共用的文件才复制）"""
+    restored = 0
+    for path in batch:
+        entry = entries[path]
+        try:
+            if os.path.exists(path):
+                logging.warning(f"原路径已存在文件，跳过恢复: {path}")
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if entry["action"] == "move":
+                shutil.move(entry["target"], path)
+            elif entry["action"] == "store":
+                if store_references.get(os.path.normpath(entry["target"]), 0) > 1:
+                    shutil.copy2(entry["target"], path)
+                else:
+                    shutil.move(entry["target"], path)
+            else:
+                continue
+            if entry["mtime"] is not None:
+                os.utime(path, (entry["mtime"], entry["mtime"]))
+            restored += 1
+            logging.info(f"恢复成功: {path}", extra={"sample": False})
+        except Exception as e:
+            logging.error(f"恢复失败: {path}, 错误: {e}")
+    return restored
+
+def undo_run(backup_folder, run_id, device_workers=DEVICE_WORKERS, batch_size=REMOVAL_BATCH_SIZE):
+    """根据操作清单撤销一次清理运行，把图片并行恢复到原路径，返回恢复的数量"""
+    start_time = time.time()
+    entries = load_run_manifest(backup_folder, run_id)
+    actions = {}
+    for path, entry in entries.items():
+        actions.setdefault(entry["action"], []).append(path)
+
+    deleted = actions.get("delete", [])
+    if deleted:
+        logging.warning(f"有 {len(deleted)} 个图片在运行时被直接删除（未启用备份），无法恢复")
+
+    renamed = actions.get("move", []) + actions.get("store", [])
+    store_references = count_store_references(backup_folder)
+    restored = sum(run_device_batches(renamed, undo_batch, (entries, store_references), device_workers, batch_size,
+                                      "恢复图片"))
+
+    # 压缩归档按索引只解压需要恢复的文件
+    archived = {}
+    for path in actions.get("archive", []):
+        if os.path.exists(path):
+            logging.warning(f"原路径已存在文件，跳过恢复: {path}")
+            continue
+        archived.setdefault(entries[path]["target"], set()).add(path)
+    for index_path, paths in archived.items():
+        restored += restore_from_archive(index_path, paths)
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    logging.info(f"撤销运行 {run_id}: 恢复 {restored}/{len(entries)} 个文件，耗时 {elapsed:.2f} 秒，"
+                 f"{restored / elapsed:.1f} 个/秒")
+    return restored
+
+def group_by_device(paths, devices=None):
+    """
+    按所在文件系统（st_dev）分组
+    devices 为扫描时记录的设备号（见 ImageInventory.devices），其中的文件不再访问磁盘；其他文件按目录 stat，同一目录只 stat 一次
+    """
+    groups = {}
+    device_cache = {}
+    for path in paths:
+        if devices is not None and path in devices:
+            groups.setdefault(devices[path], []).append(path)
+            continue
+        folder = os.path.dirname(path)
+        if folder not in device_cache:
+            try:
+                device_cache[folder] = os.stat(folder).st_dev
+            except OSError:
+                device_cache[folder] = None
+        groups.setdefault(device_cache[folder], []).append(path)
+    return groups
+
+def remove_batch(batch, backup_folder, enable_backup, store=None, manifest=None):
+    """
+    删除或备份一批图片，返回成功处理的数量（store 不为 None 时备份到内容寻址仓库）
+    manifest 不为 None 时把每个操作记录到本次运行的操作清单
+    备份到仓库时先把这一批的记录写入 manifest.jsonl 并落盘，再移动原图片
+    """
+    removed = 0
+    prepared = store.prepare_batch(batch) if store is not None else {}
+    for image in batch:
+        try:
+            stat = os.stat(image)
+            if store is not None:
+                if image not in prepared:
+                    continue
+                action, target = "store", store.put(image, prepared[image])
+            elif enable_backup:
+                # 备份未使用的图片（保留原目录结构，同一设备上为重命名）
+                backup_path = os.path.join(backup_folder, archive_member_name(image))
+                os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+                shutil.move(image, backup_path)
+                action, target = "move", os.path.abspath(backup_path)
+                logging.info(f"备份成功: {image} -> {backup_path}", extra={"sample": False})
+            else:
+                # 直接删除未使用的图片
+                os.remove(image)
+                action, target = "delete", None
+                logging.info(f"删除成功: {image}", extra={"sample": False})
+            if manifest is not None:
+                manifest.record(action, image, target, stat.st_size, stat.st_mtime)
+            removed += 1
+        except Exception as e:
+            logging.error(f"操作失败: {image}, 错误: {e}")
+    if manifest is not None:
+        manifest.sync()
+    return removed
+
+def archive_batch(batch, archive):
+    """将一批图片写入备份归档，返回成功写入的图片"""
+    archived = []
+    for image in batch:
+        try:
+            archive.add(image)
+            archived.append(image)
+        except Exception as e:
+            logging.error(f"归档失败: {image}, 错误: {e}")
+    return archived
+
+def run_device_batches(images, task, args, device_workers, batch_size, desc, devices=None):
+    """按文件系统分组，每个设备使用独立的线程池分批执行 task(批次, *args)，不同设备并行，返回各批次的结果"""
+    groups = group_by_device(sorted(images), devices)
+    executors = []
+    futures = []
+    for device, paths in groups.items():
+        executor = ThreadPoolExecutor(max_workers=device_workers)
+        executors.append(executor)
+        logging.info(f"设备 {device}: {len(paths)} 个文件，{device_workers} 个线程")
+        for i in range(0, len(paths), batch_size):
+            futures.append(executor.submit(task, paths[i:i + batch_size], *args))
+
+    results = []
+    for future in tqdm(as_completed(futures), total=len(futures), desc=desc, unit="批"):
+        results.append(future.result())
+    for executor in executors:
+        executor.shutdown()
+    return results
+
+def remove_images(images, backup_folder, enable_backup, device_workers=DEVICE_WORKERS, batch_size=REMOVAL_BATCH_SIZE,
+                  backup_mode="store", archive_compression="zstd", devices=None):
+    """
+    删除阶段：按文件系统分组，每个设备使用独立的线程池分批执行删除或备份，不同设备并行
+    同一批次内按路径排序，相邻文件位于同一目录，减少磁盘寻道
+    backup_mode 为 "store" 时备份到内容寻址仓库，
+    为 "archive" 时先把所有图片写入压缩归档并落盘，再删除已归档的图片，
+    为 "move" 时按原目录结构移动到备份文件夹
+    devices 为扫描时记录的设备号（路径 -> st_dev），分组时不再逐个目录 stat
+    """
+    if not images:
+        return 0
+
+    start_time = time.time()
+    # 只有可撤销的运行才生成操作清单，直接删除的图片只记录在日志中
+    manifest = RunManifest(backup_folder) if enable_backup else None
+    try:
+        if enable_backup and backup_mode == "archive":
+            archive = ArchiveBackup(backup_folder, archive_compression, manifest.run_id)
+            results = run_device_batches(images, archive_batch, (archive,), device_workers, batch_size, "写入备份归档", devices)
+            archive.close()
+            for entry in archive.entries:
+                manifest.record("archive", entry["path"], os.path.abspath(archive.index_path), entry["size"],
+                                entry["mtime"])
+            manifest.sync()
+            archived = [image for batch in results for image in batch]
+            removed = sum(run_device_batches(archived, remove_batch, (backup_folder, False), device_workers,
+                                             batch_size, "删除已归档的图片", devices))
+        elif enable_backup and backup_mode == "store":
+            store = BackupStore(backup_folder, manifest.run_id)
+            try:
+                removed = sum(run_device_batches(images, remove_batch, (backup_folder, True, store, manifest),
+                                                 device_workers, batch_size, "备份未使用的图片", devices))
+            finally:
+                store.close()
+        else:
+            removed = sum(run_device_batches(images, remove_batch, (backup_folder, enable_backup, None, manifest),
+                                             device_workers, batch_size, "删除未使用的图片", devices))
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    logging.info(f"已处理 {removed}/{len(images)} 个文件，耗时 {elapsed:.2f} 秒，{removed / elapsed:.1f} 个/秒")
+    return removed
+
+def process_markdown_file(md_file, image_folder, used_images, inventory=None):
+    """
+    找出单个 Markdown 文件的图片文件夹中未使用的图片（只收集，不删除）
+    used_images 为整个笔记库的已使用图片集合，inventory 为共享的图片文件清单（可选）
+    """
+
+    # 动态确定图片文件夹
+    md_filename = os.path.splitext(os.path.basename(md_file))[0]  # 获取 Markdown 文件名（不含扩展名）
+    image_folder_path = os.path.join(os.path.dirname(md_file), image_folder, md_filename)  # 图片文件夹路径
+
+    if not os.path.exists(image_folder_path):
+        logging.warning(f"图片文件夹不存在: {image_folder_path}，跳过处理文件: {md_file}")
+        return set()
+
+    # 获取图片文件夹中的所有文件（清单中的路径已是规范化的绝对路径）
+    if inventory is None:
+        inventory = ImageInventory()
+    records = inventory.scan(image_folder_path)
+    all_images = {record.path for record in records}
+    logging.debug(f"图片文件夹 {image_folder_path} 中的文件数量: {len(records)}")
+
+    # 找到未使用的图片
+    unused_images = all_images - used_images
+    if unused_images:
+        logging.info(f"正在处理文件: {md_file}")
+        logging.info(f"图片文件夹: {image_folder_path}")
+        logging.warning(f"未使用的图片数量: {len(unused_images)}")
+    else:
+        logging.info(f"文件 {md_file} 没有未使用的图片。")
+
+    return unused_images
+
+def find_markdown_files(path):
+    """查找指定路径中的所有 Markdown 文件（如果是目录则递归查找）"""
+    md_files = []
+    if os.path.isfile(path) and path.endswith(".md"):
+        # 如果是单个 Markdown 文件
+        md_files.append(path)
+    elif os.path.isdir(path):
+        # 如果是目录，递归查找所有 Markdown 文件
+        for root, _, files in os.walk(path):
+            for file in files:
+                if file.endswith(".md"):
+                    md_files.append(os.path.join(root, file))
+    else:
+        logging.error(f"路径 {path} 不是有效的 Markdown 文件或目录。")
+    return md_files
+"""
+关键改进点
+路径规范化缓存：
+以前每个图片链接都要重新查找 URL 编码的正则并调用 abspath、normpath，而同一个笔记库中相同的相对路径会重复出现成千上万次。
+新增 PathNormalizer：以 (笔记所在目录, 原始链接) 为键缓存规范化后的绝对路径，使用有界 LRU（PATH_CACHE_SIZE 条），多线程共享；
+URL 编码的正则改为预编译。清理和合并重复图片结束时输出缓存的命中率。
+"""
+if __name__ == "__main__":
+    # 设置 Markdown 文件或目录路径
+    path = "C:\\Users\\codeh\\Desktop\\CSNote"  # 替换为你的 Markdown 文件或目录路径
+
+    # 设置图片保存路径（相对于当前处理的 Markdown 文件的相对路径,会在路径后自动拼接markdown文件名）
+    image_folder = "image"
+
+    # 设置备份文件夹（绝对路径）
+    backup_folder = "backup"
+
+    # 是否启用备份功能
+    enable_backup = False  # 设置为 False 以禁用备份
+
+    # 设置备份方式："store" 内容寻址仓库，"archive" 写入压缩归档，"move" 按原目录结构移动到备份文件夹
+    backup_mode = "store"
+
+    # 设置归档压缩方式："zstd"（需要安装 zstandard）或 "gzip"
+    archive_compression = "zstd"
+
+    # 设置笔记库根目录（用于构建已使用图片集合，为 None 时使用 path 所在的目录）
+    vault_root = None
+
+    # 是否只生成重复图片报告（不删除任何文件）
+    duplicate_report = False
+
+    # 设置重复图片报告的保存路径
+    duplicate_report_file = "duplicate_images_report.json"
+
+    # 是否只生成相似图片报告（不删除任何文件，需要安装 numpy 和 Pillow）
+    near_duplicate_report = False
+
+    # 设置相似图片报告的保存路径
+    near_duplicate_report_file = "near_duplicate_images_report.json"
+
+    # 设置感知哈希方法："ahash"、"dhash" 或 "phash"
+    near_duplicate_method = "dhash"
+
+    # 设置相似图片的最大汉明距离（0-64，越小越严格）
+    near_duplicate_threshold = NEAR_DUPLICATE_THRESHOLD
+
+    # 是否合并内容完全相同的图片（更新链接后删除或硬链接多余的副本）
+    # 默认不合并：本版本只改写 Markdown、<img> 和引用定义链接，不识别 Obsidian 的 ![[图片]] 嵌入、HTML 导出和 Canvas 中的引用，
+    # 删除模式下这些文件引用的副本会失效，启用前请确认笔记库中没有这些写法，或保留 collapse_mode = "hardlink"
+    collapse_duplicates = False
+
+    # 设置多余副本的处理方式："hardlink" 替换为硬链接（默认），"remove" 删除（按备份设置备份）
+    collapse_mode = "hardlink"
+
+    # 是否只运行日志基准测试
+    run_logging_benchmark = False
+
+    # 设置需要撤销的运行编号（见日志中的“本次运行编号”），为 None 时正常执行清理
+    undo_run_id = None
+
+    if run_logging_benchmark:
+        benchmark_logging()
+        raise SystemExit(0)
+
+    if undo_run_id is not None:
+        undo_run(backup_folder, undo_run_id)
+        raise SystemExit(0)
+
+    if vault_root is None:
+        vault_root = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+
+    if duplicate_report:
+        report_duplicate_images(vault_root, duplicate_report_file, exclude_folders=[backup_folder])
+        raise SystemExit(0)
+
+    if near_duplicate_report:
+        report_near_duplicate_images(vault_root, near_duplicate_report_file, exclude_folders=[backup_folder],
+                                     method=near_duplicate_method, threshold=near_duplicate_threshold)
+        raise SystemExit(0)
+
+    # 查找所有 Markdown 文件
+    md_files = find_markdown_files(path)
+    logging.info(f"找到 {len(md_files)} 个 Markdown 文件")
+
+    # 查找笔记库中的所有 Markdown 文件
+    reference_files = find_markdown_files(vault_root)
+    logging.info(f"笔记库中共有 {len(reference_files)} 个 Markdown 文件")
+
+    if collapse_duplicates:
+        collapse_duplicate_images(reference_files, vault_root, backup_folder, enable_backup, collapse_mode,
+                                  backup_mode=backup_mode, archive_compression=archive_compression)
+
+    # 删除未使用的图片
+    delete_unused_images(md_files, image_folder, backup_folder, enable_backup, reference_files,
+                         backup_mode=backup_mode, archive_compression=archive_compression)
\ No newline at end of file